@@ -1,32 +1,51 @@
 #!/usr/bin/env python3
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import math
 from fftw3 import *
-from scipy.signal import firwin, lfilter, get_window
 from util import *
+from Governor import QUALITY_LEVELS
 import time
 
-if is_raspberry_pi():
-    os.environ['SDL_VIDEODRIVER'] = 'kmsdrm'
-    os.environ["SDL_FBDEV"] = "/dev/fb0"
-    rotate = True
-else:
-    rotate = False
-
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 import pygame
 
 LOGMIN = 10**(-96/20)
 LOGMAX = 10**(12/20)
 
-screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
-screen_width, screen_height = screen.get_size()
+# display state is populated by init_display() - nothing is opened at import time
+screen = None
+screen_width, screen_height = 0, 0
+rotate = False
+
+def init_display(rotate_display=None, size=None):
+    '''
+    Open the display and set the module level screen geometry. Must be called
+    before any mode is constructed. On a Raspberry Pi the kmsdrm framebuffer is
+    used and the display is rotated unless rotate_display says otherwise.
+    size=None opens fullscreen, otherwise a (width, height) window.
+    '''
+    global screen, screen_width, screen_height, rotate
+    if is_raspberry_pi():
+        os.environ['SDL_VIDEODRIVER'] = 'kmsdrm'
+        os.environ["SDL_FBDEV"] = "/dev/fb0"
+        rotate = True
+    else:
+        rotate = False
+    if rotate_display is not None:
+        rotate = rotate_display
+
+    pygame.init()
+    if size is None:
+        screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+    else:
+        screen = pygame.display.set_mode(size)
+    screen_width, screen_height = screen.get_size()
 
-# rotate just transpose the plot line before adding to plot history
-if rotate:
-    screen_width, screen_height = screen_height, screen_width
+    # rotate just transpose the plot line before adding to plot history
+    if rotate:
+        screen_width, screen_height = screen_height, screen_width
+    return screen
 
 class BaseMode:
     major_color = (255, 255, 255)
@@ -45,6 +64,11 @@ class BaseMode:
         self.plot_height = screen_height - 2 * self.y_margin
         self.plot_color = (255, 0, 255)
         self.plot_surface = pygame.Surface((self.plot_width, self.plot_height))
+        self.plot_rect = pygame.Rect(self.x_margin, self.y_margin, self.plot_width, self.plot_height)
+        self.status_rect = None
+        self.changed = True
+        # while paused the mode keeps its data current but leaves plot_surface alone
+        self.paused = False
 
         self.mx = self.my = 1
         self.bx = self.by = 0
@@ -53,18 +77,40 @@ class BaseMode:
         screen.fill((0,0,0)) # blank doesn't clear the screen outside of plot_surface
         self.blank()
         self.draw_axes()
+        self.status_rect = None
+        self.changed = True
         # pygame.display.flip()
 
     def blank(self):
-        screen.fill((0,0,0)) # blank doesn't clear the screen outside of plot_surface
+        screen.fill((0,0,0), self.plot_rect) # blank doesn't clear the screen outside of plot_surface
 
 
     def update_plot(self):
+        '''
+        Draw the plot surface to the screen and return the list of screen
+        rectangles that changed. Axes are only drawn by setup_plot.
+        '''
+        if not self.changed:
+            return []
+        self.changed = False
         self.blank()
         pygame.draw.rect(self.plot_surface, self.plot_color, (0, 0, self.plot_width, self.plot_height), 1)  # Draw only the outline
-        self.draw_axes()
-        screen.blit(self.plot_surface, (self.x_margin, self.y_margin))
+        screen.blit(self.plot_surface, self.plot_rect)
         # pygame.display.flip()
+        return [self.plot_rect]
+
+    def draw_status(self, status):
+        # small text in the bottom right corner, returns the rectangle it touched
+        text = self.font.render(status, True, BaseMode.minor_color)
+        x = screen.get_width() - text.get_width() - BaseMode.minor_tick_length
+        y = screen.get_height() - text.get_height() - BaseMode.minor_tick_length
+        rect = text.get_rect(topleft=(x, y))
+        dirty = rect if self.status_rect is None else rect.union(self.status_rect)
+        if self.status_rect is not None:
+            screen.fill((0,0,0), self.status_rect)
+        screen.blit(text, rect)
+        self.status_rect = rect
+        return dirty
 
     def calculate_label_size(self, labels):
         width, height = 0, 0
@@ -153,10 +199,15 @@ class SPLMode(BaseMode):
         self.y_labels[-2] = " 0" # fix intentionally broken python behavior
         self.text_size = self.calculate_label_size(self.y_labels)
         self.y_minor = [y for y in range(-96, 12, 3) if y not in self.y_major]
-        self.spl_plot = np.array([-96] * self.plot_width)
+        self.spl_plot = np.full(self.plot_width, -96.0)
         self.plot_surface.set_colorkey((0, 0, 0))  # Use a transparent color
         self.min_spl = 100
         self.max_spl = -100
+        self.set_quality(0)
+
+    def set_quality(self, level):
+        self.quality = level
+        self.decimation = QUALITY_LEVELS[level]['spl_decimation']
 
     def draw_axes(self):
         self.draw_axis(major = self.y_major, labels = self.y_labels, minor = self.y_minor, orientation='y')
@@ -169,18 +220,35 @@ class SPLMode(BaseMode):
         rms = max(LOGMIN, min(rms, LOGMAX))
         spl = round(20 * np.log10(rms), 1)  # Convert to dB
 
+        self.push_spl(spl)
+
+    def push_spl(self, spl):
         # roll data and push new volume
         self.spl_plot = np.roll(self.spl_plot, -1)
         self.spl_plot[-1] = spl
         self.min_spl = min(self.min_spl, spl)
         self.max_spl = max(self.max_spl, spl)
-        
+        if not self.paused:
+            self.draw_trace(self.spl_plot)
+
+    def show_history(self, history, end_seq, step=1):
+        # draw recorded levels up to end_seq instead of the live plot
+        frames = history.window(end_seq, self.plot_width, step)
+        trace = np.full(self.plot_width, -96.0)
+        if len(frames):
+            trace[self.plot_width - len(frames):] = frames['spl']
+        self.draw_trace(trace)
+
+    def draw_trace(self, trace):
         # draw the SPL plot to plot_surface
         self.plot_surface.fill((0,0,0))
+        self.changed = True
 
-        for x in range(len(self.spl_plot) -1):
-            p0 = (self.scale_xpos(x),   self.scale_ypos(self.spl_plot[x  ]))
-            p1 = (self.scale_xpos(x+1), self.scale_ypos(self.spl_plot[x+1]))
+        # step back from the newest sample so the right edge is always drawn
+        step = self.decimation
+        for x in range(len(trace) - 1, step - 1, -step):
+            p0 = (self.scale_xpos(x-step), self.scale_ypos(trace[x-step]))
+            p1 = (self.scale_xpos(x),      self.scale_ypos(trace[x     ]))
             pygame.draw.line(self.plot_surface, self.plot_color, p0, p1)
 
             # draw pixels instead of lines
@@ -193,11 +261,13 @@ class ACFMode(BaseMode):
         g = np.clip(255*intensity, 0, 255)
         b = np.clip(255 * (1 - np.exp(-np.log(2) / blue_point * intensity)), 0, 255)
         b = np.clip(b-g, 0, 255)
-        return np.array([r,g,b]).transpose(1,0).astype(np.uint8)
+        return np.stack([r,g,b], axis=-1).astype(np.uint8)
 
-    def __init__(self, windowsize=16384, samplerate=48000):
+    def __init__(self, windowsize=16384, samplerate=48000, tracker=None):
         super().__init__()
         self.samplerate = samplerate
+        # optional Tracker.PeakTracker, drawn as an overlay when set
+        self.tracker = tracker
         self.acf_plot = np.zeros((self.plot_width, self.plot_height,3), dtype=np.uint8)
         self.plot_color = (0, 0, 255)
 
@@ -213,6 +283,9 @@ class ACFMode(BaseMode):
         self.bx = -self.mx * math.log2(self.x_major[0])
 
         # FFT parameters
+        from scipy.signal import firwin, get_window, lfilter
+        # kept for process_data so the hot path does not repeat the import
+        self.lfilter = lfilter
         self.window_size = 2**(int(math.log2(windowsize)))
         self.linear_freq_bins = np.fft.rfftfreq(self.window_size, 1 / self.samplerate)
         self.log_freq_bins = np.logspace(np.log2(self.x_major[0]), np.log2(self.x_major[-1]), self.plot_width, base=2)
@@ -222,6 +295,30 @@ class ACFMode(BaseMode):
         self.hpf = firwin(1023, 2*40/self.samplerate, pass_zero=False)
         self.lpf = firwin(1023, 2*20e3/self.samplerate, pass_zero=True)
         self.window = get_window('hann', self.window_size)
+
+        # precompute the tables for every quality level so set_quality never stalls
+        self.quality_tables = []
+        for level in QUALITY_LEVELS:
+            window_size = max(1024, self.window_size >> level['window_shift'])
+            n_bins = max(16, self.plot_width // level['bin_divisor'])
+            self.quality_tables.append({
+                'window_size': window_size,
+                'hop': level['hop'],
+                'window': get_window('hann', window_size),
+                # planned once here, FFTW_MEASURE planning is too slow for a frame.
+                # The inverse plan computes the tracker's autocorrelation.
+                'plan': fftw_plan(window_size, inverse=tracker is not None),
+                'linear_freq_bins': np.fft.rfftfreq(window_size, 1 / self.samplerate),
+                'log_freq_bins': np.logspace(np.log2(self.x_major[0]), np.log2(self.x_major[-1]), n_bins, base=2),
+                # column index of each plot pixel into the rendered bins
+                'bin_expand': np.linspace(0, n_bins - 1, self.plot_width).round().astype(int),
+                # reduced levels draw n_bins columns here and scale them up to plot_surface
+                'surface': None if n_bins == self.plot_width else pygame.Surface((n_bins, self.plot_height)),
+            })
+        self.quality = 0
+        self.pending = 0
+        self.set_quality(0)
+
         acf_hpf_idx = np.argmax(self.linear_freq_bins > 200)
         f0 = acf_hpf_idx // 2
         self.acf_mask = np.array([
@@ -230,6 +327,10 @@ class ACFMode(BaseMode):
             1.0
             for f in range(len(self.linear_freq_bins)//2)])
         
+        self.spectrum = np.zeros(self.plot_width)
+        self.autocorr = np.zeros(self.plot_width)
+
+        self.track_colors = None
         self.min_fft = 0
         self.max_fft = 0
         self.min_acf = 0
@@ -239,12 +340,30 @@ class ACFMode(BaseMode):
     def scale_xpos(self, pos):
         return int(math.log2(pos) * self.mx + self.bx)
 
+    def set_quality(self, level):
+        # swap in the precomputed tables for this level
+        table = self.quality_tables[level]
+        self.quality = level
+        self.window_size = table['window_size']
+        self.hop = table['hop']
+        self.window = table['window']
+        self.plan = table['plan']
+        self.linear_freq_bins = table['linear_freq_bins']
+        self.log_freq_bins = table['log_freq_bins']
+        self.bin_expand = table['bin_expand']
+        self.draw_surface = table['surface']
+
+        # the waterfall is kept at the rendered width, carry its rows over
+        n_bins = len(self.log_freq_bins)
+        if len(self.acf_plot) != n_bins:
+            self.acf_plot = self.acf_plot[self.bin_index(len(self.acf_plot), n_bins)]
+
     def draw_axes(self):
         self.draw_axis(major = self.x_major, labels = self.x_labels, minor = self.x_minor, orientation='x')
 
     def update_history(self, data):
         # Roll the history buffer and push new data        
-        roll_len = min(len(data), self.window_size)
+        roll_len = min(len(data), len(self.history))
         if roll_len > 0:
             self.history = np.roll(self.history, -roll_len)
             self.history[-roll_len:] = data[-roll_len:]
@@ -260,6 +379,12 @@ class ACFMode(BaseMode):
         
         self.update_history(data)
 
+        # only analyse once at least hop new samples have arrived
+        self.pending += len(data)
+        if self.pending < self.hop:
+            return False
+        self.pending = 0
+
         # Apply the window to the history buffer
         windowed_data = self.history[-self.window_size:] * self.window
         
@@ -267,15 +392,19 @@ class ACFMode(BaseMode):
         windowed_data = windowed_data / np.max(windowed_data)
 
         # Apply high-pass filter to the windowed data
-        filtered = lfilter(self.hpf, 1, windowed_data)
+        filtered = self.lfilter(self.hpf, 1, windowed_data)
 
         # Apply low-pass filters to the history buffer
-        filtered = lfilter(self.lpf, 1, filtered)
+        filtered = self.lfilter(self.lpf, 1, filtered)
 
         if self.fake:
             fft_data = fake_fft()
         else:
-            fft_data = np.abs(fftw_rfft(windowed_data))
+            fft_data = np.abs(self.plan.execute(windowed_data))
+
+        if self.tracker is not None:
+            # time domain autocorrelation from the power spectrum for the pitch estimate
+            self.tracker.update(fft_data, self.samplerate / self.window_size, self.plan.autocorrelation(fft_data), self.samplerate)
 
         normalized_fft  = np.clip(fft_data / self.window_size, 0, 1)
 
@@ -298,19 +427,123 @@ class ACFMode(BaseMode):
         # map autocorrelation to log_bins so we can combine it with fft
         autocorr = np.interp(self.log_freq_bins, np.linspace(0, len(autocorr), len(autocorr)), autocorr)
 
-        # roll data and push new volume
-        self.acf_plot = np.roll(self.acf_plot, -1, axis=1)
         self.min_fft = max(self.min_fft, np.min(log_fft_data))
         self.max_fft = max(self.max_fft, np.max(log_fft_data))
         self.min_acf = min(self.min_acf, np.min(autocorr))
         self.max_acf = max(self.max_acf, np.max(autocorr))
-
         # print(f"min_fft: {self.min_fft}, max_fft: {self.max_fft}, min_acf: {self.min_acf}, max_acf: {self.max_acf}")
-        self.acf_plot[:, -1, :] = ACFMode.colorize(log_fft_data, autocorr)
 
-        # Draw the ACF plot to plot_surface
-        self.blank()
-        pygame.surfarray.blit_array(self.plot_surface, self.acf_plot)
+        self.push_column(log_fft_data, autocorr)
+        return True
+
+    def bin_index(self, src_bins, dst_bins):
+        # map each of dst_bins log frequency bins to one of src_bins
+        if (src_bins, dst_bins) == (len(self.log_freq_bins), self.plot_width):
+            return self.bin_expand
+        return np.linspace(0, src_bins - 1, dst_bins).round().astype(int)
+
+    def push_column(self, spectrum, autocorr):
+        '''
+        Scroll in one analysed frame. Used for live data and for replaying
+        recorded frames, which may have been taken at a different width.
+        '''
+        n_bins = len(self.log_freq_bins)
+        if len(spectrum) != n_bins:
+            index = self.bin_index(len(spectrum), n_bins)
+            spectrum = spectrum[index]
+            autocorr = autocorr[index]
+
+        # roll data and push new volume
+        self.acf_plot = np.roll(self.acf_plot, -1, axis=1)
+        self.acf_plot[:, -1, :] = ACFMode.colorize(spectrum, autocorr)
+
+        # latest column at plot resolution, for export and recording
+        self.spectrum = spectrum[self.bin_expand]
+        self.autocorr = autocorr[self.bin_expand]
+
+        if self.paused:
+            return
+        # Draw the ACF plot to plot_surface, at reduced levels through the narrow surface
+        if self.draw_surface is None:
+            pygame.surfarray.blit_array(self.plot_surface, self.acf_plot)
+        else:
+            pygame.surfarray.blit_array(self.draw_surface, self.acf_plot)
+            pygame.transform.scale(self.draw_surface, (self.plot_width, self.plot_height), self.plot_surface)
+        if self.tracker is not None:
+            self.draw_tracks()
+        self.changed = True
+
+    def draw_tracks(self):
+        # markers along the newest row for stable tracks, a white tick for the fundamental
+        if self.track_colors is None:
+            self.track_colors = make_color_palette(self.tracker.max_tracks)
+        y = self.plot_height - 6
+        low, high = self.x_major[0], self.x_major[-1]
+        ids, freqs, _ = self.tracker.active_tracks(min_age=3)
+        for track_id, freq in zip(ids, freqs):
+            if low <= freq <= high:
+                color = self.track_colors[track_id % len(self.track_colors)]
+                pygame.draw.circle(self.plot_surface, color, (self.scale_xpos(freq), y), 4, 1)
+        if low <= self.tracker.f0 <= high:
+            x = self.scale_xpos(self.tracker.f0)
+            pygame.draw.line(self.plot_surface, BaseMode.major_color, (x, y - 12), (x, self.plot_height - 1), 2)
+
+    def show_history(self, history, end_seq, step=1):
+        # draw recorded frames up to end_seq instead of the live plot
+        # only frames which carried a new analysis become rows, as in the live view
+        frames = history.window(end_seq, self.plot_height, step, fresh_only=True)
+        plot = np.zeros((self.plot_width, self.plot_height, 3), dtype=np.uint8)
+        if len(frames):
+            expand = self.bin_index(frames['spectrum'].shape[1], self.plot_width)
+            colors = ACFMode.colorize(frames['spectrum'].astype(float), frames['acf'].astype(float))
+            plot[:, self.plot_height - len(frames):, :] = colors[:, expand, :].transpose(1, 0, 2)
+        pygame.surfarray.blit_array(self.plot_surface, plot)
+        self.changed = True
+
+class DisplayUpdater:
+    '''
+    Pushes frames to the display. Normally only the rectangles reported by
+    the modes are updated; a full flip is used for the first frame and after
+    full_repaint(). method='auto' times both for a number of frames and keeps
+    whichever is faster, since some drivers gain nothing from partial updates.
+    '''
+    def __init__(self, method='auto', calibration_frames=30):
+        if method not in ('auto', 'rects', 'flip'):
+            raise ValueError(f'Unknown display update method {method}')
+        self.method = method
+        self.calibration_frames = calibration_frames
+        self.timings = {'rects': [], 'flip': []}
+        self.full = True
+
+    def full_repaint(self):
+        self.full = True
+
+    def present(self, rects):
+        if self.full:
+            pygame.display.flip()
+            self.full = False
+            return
+
+        method = self.method
+        if method == 'auto':
+            # alternate methods while calibrating so both see the same load
+            n = len(self.timings['rects']) + len(self.timings['flip'])
+            method = 'rects' if n % 2 == 0 else 'flip'
+
+        t0 = time.perf_counter()
+        if method == 'rects':
+            if rects:
+                pygame.display.update(rects)
+        else:
+            pygame.display.flip()
+
+        if self.method == 'auto':
+            self.timings[method].append(time.perf_counter() - t0)
+            if len(self.timings['flip']) >= self.calibration_frames:
+                rects_time = np.median(self.timings['rects'])
+                flip_time = np.median(self.timings['flip'])
+                self.method = 'rects' if rects_time <= flip_time else 'flip'
+                print(f'display update: {self.method} (rects {1e3*rects_time:.2f} ms, flip {1e3*flip_time:.2f} ms)')
 
 def test_spl():
     global start_time, LOGMIN, LOGMAX
@@ -368,7 +601,7 @@ def test_acf():
 
 if __name__ == "__main__":
     import sys
-    pygame.init()
+    init_display()
 
     tests = [test_spl, test_acf]
     if len(sys.argv) > 1:
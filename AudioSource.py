@@ -1,22 +1,27 @@
 #!/usr/bin/env python3
-import soundfile as sf
 import time
 import numpy as np
 import threading
 import os
 import logging
-
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
+from Resampler import StreamResampler
 
 samplerate = None
 p = None
-if not p:
-    import pyaudio
-    p = pyaudio.PyAudio()
 
-def list_audio_devices():
+def init_audio():
+    '''
+    Create the PyAudio instance on first use. Importing this module does not
+    touch the audio server; only the real-time source and device listing do.
+    '''
     global p
+    if p is None:
+        import pyaudio
+        p = pyaudio.PyAudio()
+    return p
+
+def list_audio_devices():
+    init_audio()
     for i in range(p.get_device_count()):
         dev = p.get_device_info_by_index(i)
         if dev['maxInputChannels'] < 1:
@@ -28,7 +33,10 @@ def RealTimeAudioSource(source):
     # Initialize audio capture
     os.environ['PA_ALSA_PLUGHW'] = '1'
     os.environ['PYTHONWARNINGS'] = 'ignore'
+    init_audio()
+    import pyaudio
     bufflen = 2**16    
+    period = 1024
 
     def get_audio_device_index(name):
         for i in range(p.get_device_count()):
@@ -42,18 +50,16 @@ def RealTimeAudioSource(source):
         return None
 
     def get_preferred_samplerate(dev_index):
+        # any rate will do, resampled() converts it to the analysis rate
         dev = p.get_device_info_by_index(dev_index)
-        for rate in [48000, 44100, 96000, 192000]:
-            if dev['defaultSampleRate'] == rate:
-                return rate
-        raise ValueError('No supported sample rate found')
+        return int(dev['defaultSampleRate'])
 
     def _capture_audio():
-        nonlocal buffer, write_index, stop_flag
+        nonlocal buffer, write_index, written, stop_flag
         while not stop_flag:
             try:
                 # Capture new audio data
-                data = stream.read(bufflen, exception_on_overflow=False)
+                data = stream.read(period, exception_on_overflow=False)
                 new_data = np.frombuffer(data, dtype=np.int16)
 
                 # Safely update the buffer in a thread-safe manner (circular buffer)
@@ -71,6 +77,7 @@ def RealTimeAudioSource(source):
 
                     # Update write_index
                     write_index = end_index
+                    written += len(new_data)
             except OSError as e:
                 if e.errno == -9981:
                     logging.error('input overflowed: skipping buffer')
@@ -82,33 +89,37 @@ def RealTimeAudioSource(source):
         raise RuntimeError('No audio input device found')
 
     samplerate = get_preferred_samplerate(source)
-    stream = p.open(format=pyaudio.paInt16, channels=1, rate=samplerate, input=True, frames_per_buffer=1024, input_device_index=source)
+    stream = p.open(format=pyaudio.paInt16, channels=1, rate=samplerate, input=True, frames_per_buffer=period, input_device_index=source)
 
     # Initialize circular buffer and threading
     buffer = np.zeros(bufflen, dtype=np.int16)
     write_index = 0
+    written = 0 # total samples captured, so the reader knows what is new
+    read = 0
     lock = threading.Lock()
     stop_flag = False
     capture_thread = threading.Thread(target=_capture_audio)
     capture_thread.start()
 
-    # Generator to yield the latest audio data
+    # Generator to yield the audio captured since the last call, like FileAudioSource
     while True:
-        t0 = time.time()
-
-        # Safely access the buffer and return the last `chunksize` samples
+        # Safely access the buffer and return the new samples
         with lock:
-            # Return a copy of the circular buffer, starting from the correct point
-            if write_index == bufflen:
-                chunk = buffer.copy()  # No wrapping needed
+            # if we fell more than a buffer behind the oldest samples are lost
+            new = min(written - read, bufflen)
+            read = written
+            start = write_index - new
+            if start >= 0:
+                chunk = buffer[start:write_index].copy()  # No wrapping needed
             else:
-                # Return the last `chunksize` samples in proper order (handle wrap-around)
-                chunk = np.concatenate((buffer[write_index:], buffer[:write_index]))
+                # handle wrap-around
+                chunk = np.concatenate((buffer[start:], buffer[:write_index]))
 
         yield chunk
 
 def FileAudioSource(testdir):
     global samplerate
+    import soundfile as sf
     files = os.listdir(testdir)
     while True:
         for f in files:
@@ -136,3 +147,21 @@ def FileAudioSource(testdir):
                     yield chunk
 
         files = os.listdir(testdir)
+
+def resampled(source, rate):
+    '''
+    Wrap an audio source generator so every chunk comes out at rate, whatever
+    rate the device or file runs at. Resamplers are cached per input rate and
+    their filter state carries across chunks; switching rate (a new file)
+    starts that rate's stream afresh.
+    '''
+    resamplers = {}
+    current = None
+    for chunk in source:
+        if current is None or current.in_rate != samplerate:
+            if samplerate not in resamplers:
+                logging.info(f'resampling {samplerate} Hz input to {rate} Hz')
+                resamplers[samplerate] = StreamResampler(samplerate, rate)
+            current = resamplers[samplerate]
+            current.reset()
+        yield current.process(chunk)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# adaptive quality governor - trades analysis and drawing detail for frame rate
+
+# Level 0 is full quality, each following level is cheaper to compute and draw.
+# window_shift  - FFT window is the configured window size >> window_shift
+# hop           - minimum new samples between ACF analyses (0 = every frame)
+# bin_divisor   - log frequency bins analysed and drawn are plot_width // bin_divisor,
+#                 the narrow waterfall is scaled up to the plot width
+# spl_decimation - draw every Nth point of the SPL trace
+QUALITY_LEVELS = [
+    {'window_shift': 0, 'hop': 0,    'bin_divisor': 1, 'spl_decimation': 1},
+    {'window_shift': 0, 'hop': 2048, 'bin_divisor': 1, 'spl_decimation': 2},
+    {'window_shift': 1, 'hop': 4096, 'bin_divisor': 2, 'spl_decimation': 2},
+    {'window_shift': 2, 'hop': 4096, 'bin_divisor': 2, 'spl_decimation': 4},
+    {'window_shift': 2, 'hop': 8192, 'bin_divisor': 4, 'spl_decimation': 8},
+]
+
+class QualityGovernor:
+    '''
+    Watches measured frame times against a target frame rate and steps the
+    quality level between min_level and max_level. Quality drops quickly when
+    frames are late, after drop_cooldown frames, and recovers slowly once
+    there is clear headroom, after cooldown frames. The frame time average
+    restarts after every change so each step is judged on the new level
+    only and the level does not oscillate.
+    '''
+    def __init__(self, target_fps=20, min_level=0, max_level=None, smoothing=0.1, cooldown=30, drop_cooldown=5):
+        if max_level is None:
+            max_level = len(QUALITY_LEVELS) - 1
+        if not 0 <= min_level <= max_level < len(QUALITY_LEVELS):
+            raise ValueError(f'quality bounds must satisfy 0 <= min <= max < {len(QUALITY_LEVELS)}')
+        self.target_fps = target_fps
+        self.min_level = min_level
+        self.max_level = max_level
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.drop_cooldown = drop_cooldown
+        self.level = min_level
+        self.frame_time = 0
+        self.frames_since_change = 0
+
+    def update(self, frame_time):
+        '''
+        Record the time taken by the last frame in seconds.
+        Returns True if the quality level changed.
+        '''
+        if self.frame_time == 0:
+            self.frame_time = frame_time
+        else:
+            self.frame_time += self.smoothing * (frame_time - self.frame_time)
+        self.frames_since_change += 1
+
+        if not self.target_fps:
+            return False
+
+        budget = 1 / self.target_fps
+        if self.frame_time > 1.1 * budget and self.level < self.max_level and self.frames_since_change >= self.drop_cooldown:
+            self.level += 1
+        elif self.frame_time < 0.6 * budget and self.level > self.min_level and self.frames_since_change >= self.cooldown:
+            self.level -= 1
+        else:
+            return False
+        self.frames_since_change = 0
+        self.frame_time = 0
+        return True
+
+    def fps(self):
+        return 1 / self.frame_time if self.frame_time > 0 else 0
+
+    def status(self):
+        return f'Q{self.level} {self.fps():.0f} fps'
+
+def test_governor():
+    governor = QualityGovernor(target_fps=20, cooldown=30, drop_cooldown=5)
+
+    # late frames step down one level every drop_cooldown frames
+    changes = [i for i in range(1, 21) if governor.update(0.2)]
+    assert changes == [5, 10, 15, 20] and governor.level == 4, changes
+
+    # frames within budget but without clear headroom leave the level alone
+    assert not any(governor.update(0.04) for _ in range(100))
+
+    # headroom steps back up, but only every cooldown frames
+    changes = [i for i in range(1, 121) if governor.update(0.01)]
+    assert len(changes) == 4 and all(b - a == 30 for a, b in zip(changes, changes[1:])), changes
+    assert governor.level == 0 and not governor.update(0.001)
+
+    # no target frame rate means no governing
+    governor = QualityGovernor(target_fps=0)
+    assert not any(governor.update(1.0) for _ in range(100))
+
+    try:
+        QualityGovernor(min_level=3, max_level=2)
+    except ValueError:
+        pass
+    else:
+        assert False, 'bad quality bounds accepted'
+    print('governor ok')
+
+if __name__ == "__main__":
+    test_governor()
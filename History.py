@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# memory mapped on-disk ring of computed frames for scrollback and replay
+import os
+import time
+import numpy as np
+from SharedFrames import HEADER_DTYPE, slot_dtype, ring_views
+
+MAGIC = b'RTAHIS02'
+
+# spectrum and autocorrelation are in 0..1 so half floats are plenty and halve the file
+VALUE_TYPE = '<f2'
+
+class HistoryFile:
+    '''
+    Fixed size ring of timestamped SPL, spectrum and autocorrelation frames
+    memory mapped from a file. Once the ring is full the oldest frames are
+    overwritten, so a long session never grows past the file size. An
+    existing file is reopened and appended to; mode='r' opens it read-only
+    for replay.
+    '''
+    def __init__(self, path, spectrum_len=None, acf_len=None, slots=36000, mode='a'):
+        self.path = path
+        if os.path.exists(path) and mode != 'w':
+            self.mm = np.memmap(path, dtype=np.uint8, mode='r' if mode == 'r' else 'r+')
+            self.header, self.ring = ring_views(self.mm, VALUE_TYPE)
+            if bytes(self.header['magic']) != MAGIC:
+                raise ValueError(f'{path} is not an rta history file')
+            if spectrum_len is not None and (spectrum_len, acf_len) != (int(self.header['spectrum_len']), int(self.header['acf_len'])):
+                raise ValueError(f'{path} was recorded with a different plot width')
+        elif mode == 'r':
+            raise FileNotFoundError(path)
+        else:
+            size = HEADER_DTYPE.itemsize + slots * slot_dtype(spectrum_len, acf_len, VALUE_TYPE).itemsize
+            self.mm = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+            header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.mm)
+            header['write_seq'] = -1
+            header['slots'] = slots
+            header['spectrum_len'] = spectrum_len
+            header['acf_len'] = acf_len
+            header['magic'] = MAGIC
+            del header
+            self.header, self.ring = ring_views(self.mm, VALUE_TYPE)
+            self.ring['seq'] = -1
+        self.seq = int(self.header['write_seq'])
+
+    def append(self, spl, spectrum, acf, fresh=True, timestamp=None):
+        '''
+        Record one frame. With fresh=False only the SPL is new: spectrum and
+        acf are not written, so the slot keeps whatever payload it held and
+        readers must check fresh before using it.
+        '''
+        self.seq += 1
+        slot = self.ring[self.seq % len(self.ring)]
+        slot['seq'] = -1
+        slot['time'] = time.time() if timestamp is None else timestamp
+        slot['spl'] = spl
+        slot['fresh'] = fresh
+        if fresh:
+            # skipping repeated analyses saves most of the writes to the card
+            slot['spectrum'] = spectrum
+            slot['acf'] = acf
+        slot['seq'] = self.seq
+        self.header['write_seq'] = self.seq
+        return self.seq
+
+    def latest_seq(self):
+        return int(self.header['write_seq'])
+
+    def oldest_seq(self):
+        return max(0, self.latest_seq() - len(self.ring) + 1)
+
+    def window(self, end_seq, count, step=1, fresh_only=False):
+        '''
+        Return up to count frames ending at end_seq, taking every step-th
+        frame, oldest first. Frames outside the ring are left out. With
+        fresh_only, frames which repeat the previous analysis are skipped
+        before stepping.
+        '''
+        if fresh_only:
+            seqs = np.arange(self.oldest_seq(), min(end_seq, self.latest_seq()) + 1)
+            seqs = seqs[self.ring['fresh'][seqs % len(self.ring)] != 0]
+            seqs = seqs[::-1][:count * step:step][::-1]
+        else:
+            seqs = end_seq - step * np.arange(count)[::-1]
+            seqs = seqs[(seqs >= self.oldest_seq()) & (seqs <= self.latest_seq())]
+        return self.ring[seqs % len(self.ring)]
+
+    def seek(self, timestamp):
+        # frames are appended in time order so a binary search over sequence numbers works
+        lo, hi = self.oldest_seq(), self.latest_seq()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ring['time'][mid % len(self.ring)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def replay(self, start_seq=None, speed=1.0):
+        '''
+        Generator which yields the list of recorded frames that have come due
+        since the last call, keeping the original timing between frames.
+        '''
+        seq = self.oldest_seq() if start_seq is None else start_seq
+        t0 = time.time()
+        rec_t0 = self.ring['time'][seq % len(self.ring)]
+        while seq <= self.latest_seq():
+            due = rec_t0 + speed * (time.time() - t0)
+            frames = []
+            while seq <= self.latest_seq() and self.ring['time'][seq % len(self.ring)] <= due:
+                frames.append(self.ring[seq % len(self.ring)])
+                seq += 1
+            yield frames
+
+    def flush(self):
+        if self.mm.mode != 'r':
+            self.mm.flush()
+
+    def close(self):
+        self.flush()
+        del self.header, self.ring, self.mm
+
+def test_history():
+    import tempfile
+    width = 64
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'history.rta')
+        history = HistoryFile(path, width, width, slots=100)
+        for i in range(250):
+            history.append(-i / 10, np.full(width, i / 250), np.full(width, 1 - i / 250), fresh=i % 3 == 0, timestamp=1000 + i / 20)
+        assert history.latest_seq() == 249 and history.oldest_seq() == 150
+        frames = history.window(249, 10, step=2)
+        assert list(frames['seq']) == list(range(231, 250, 2))
+        assert len(history.window(160, 50)) == 11
+        assert history.seek(1000 + 200 / 20) == 200
+        assert list(history.window(249, 3, step=2, fresh_only=True)['seq']) == [237, 243, 249]
+        # stale frames leave the payload of the slot's last fresh frame (seq 48) alone
+        assert abs(float(history.window(248, 1)['spectrum'][0][0]) - 48 / 250) < 1e-3
+        history.close()
+
+        # reopening appends after the last frame
+        history = HistoryFile(path, width, width)
+        assert history.append(0, np.zeros(width), np.zeros(width)) == 250
+        history.close()
+
+        replayed = HistoryFile(path, mode='r')
+        assert abs(float(replayed.window(201, 1)['spectrum'][0][0]) - 201 / 250) < 1e-3
+        replayed.close()
+    print('history ok')
+
+if __name__ == "__main__":
+    test_history()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# streaming polyphase sample rate conversion
+from fractions import Fraction
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+class StreamResampler:
+    '''
+    Converts blocks of samples from in_rate to out_rate by the rational
+    factor up/down using a polyphase FIR bank. The filter history and the
+    output phase are carried from one block to the next, so a stream cut
+    into arbitrary blocks resamples exactly as if it were one long block.
+    The lowpass is flat to passband, the top of the ACF plot, and down by
+    attenuation dB at the lower of the two Nyquist rates; the number of
+    taps per phase follows from that transition band.
+    '''
+    def __init__(self, in_rate, out_rate, passband=20000, attenuation=80):
+        ratio = Fraction(int(out_rate), int(in_rate)).limit_denominator(1000)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+
+        if self.up == self.down:
+            self.taps = 1
+            self.bank = None
+        else:
+            from scipy.signal import firwin, kaiserord
+            nyquist = min(in_rate, out_rate) / 2
+            passband = min(passband, 0.9 * nyquist)
+            fs = self.up * in_rate
+            numtaps, beta = kaiserord(attenuation, (nyquist - passband) / (fs / 2))
+            self.taps = -(-numtaps // self.up)
+            h = firwin(self.up * self.taps, (passband + nyquist) / 2, window=('kaiser', beta), fs=fs) * self.up
+            # bank[p] holds phase p's taps reversed, ready to dot with x[base-taps+1 .. base]
+            self.bank = h.reshape(self.taps, self.up).T[:, ::-1].copy()
+        self.reset()
+
+    def reset(self):
+        # forget the stream, e.g. when a new file starts
+        self.tail = np.zeros(self.taps - 1)
+        self.in_count = 0
+        self.out_count = 0
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if self.bank is None or len(block) == 0:
+            return block
+
+        start = self.in_count - len(self.tail) # stream index of buf[0]
+        buf = np.concatenate((self.tail, block))
+        self.in_count += len(block)
+
+        # every output whose newest input sample has now arrived
+        end = (self.in_count * self.up + self.down - 1) // self.down
+        n = np.arange(self.out_count, end, dtype=np.int64)
+        self.out_count = end
+        pos = n * self.down
+        base = pos // self.up - start
+        phase = pos % self.up
+
+        windows = sliding_window_view(buf, self.taps)
+        out = np.einsum('ij,ij->i', windows[base - self.taps + 1], self.bank[phase])
+
+        self.tail = buf[len(buf) - len(self.tail):]
+        return out
+
+def test_resampler():
+    in_rate, out_rate = 44100, 48000
+    t = np.arange(in_rate) / in_rate
+    x = np.sin(2 * np.pi * 1000 * t)
+
+    whole = StreamResampler(in_rate, out_rate).process(x)
+
+    # the same signal in ragged blocks must give the same samples
+    streaming = StreamResampler(in_rate, out_rate)
+    cuts = np.cumsum(np.random.randint(1, 3000, size=100))
+    cuts = cuts[cuts < len(x)]
+    blocks = [streaming.process(b) for b in np.split(x, cuts)]
+    joined = np.concatenate(blocks)
+    assert len(joined) == len(whole) == out_rate, (len(joined), len(whole))
+    assert np.allclose(joined, whole), np.max(np.abs(joined - whole))
+
+    # the tone stays at 1 kHz with unit amplitude once the filter has settled
+    settled = joined[out_rate // 2:]
+    spectrum = np.abs(np.fft.rfft(settled * np.hanning(len(settled))))
+    peak = np.argmax(spectrum) * out_rate / len(settled)
+    assert abs(peak - 1000) < 2, peak
+    assert abs(np.max(np.abs(settled)) - 1) < 0.01, np.max(np.abs(settled))
+
+    def level(in_rate, f):
+        # output level in dB of a full scale tone at f, once settled
+        x = np.sin(2 * np.pi * f * np.arange(in_rate) / in_rate)
+        y = StreamResampler(in_rate, out_rate).process(x)[out_rate // 4:]
+        window = np.hanning(len(y))
+        return 20 * np.log10(np.max(np.abs(np.fft.rfft(y * window))) / (window.sum() / 2))
+
+    # flat to the top of the plot, and nothing above the lower Nyquist rate folds back
+    for rate in (44100, 96000):
+        assert abs(level(rate, 20000)) < 0.1, (rate, level(rate, 20000))
+    assert level(96000, 26000) < -70, level(96000, 26000)
+    print(f'{in_rate} -> {out_rate}: {streaming.up}/{streaming.down} x {streaming.taps} taps, peak {peak:.1f} Hz')
+
+if __name__ == "__main__":
+    test_resampler()
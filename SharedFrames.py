@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# shared memory export of per-frame results for other local processes
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = b'RTAFRM01'
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('write_seq', '<i8'),     # sequence number of the last completed frame, -1 before the first
+    ('slots', '<i8'),
+    ('spectrum_len', '<i8'),
+    ('acf_len', '<i8'),
+], align=True)
+
+def slot_dtype(spectrum_len, acf_len, value_type='<f4'):
+    # seq is -1 while a slot is being written and the frame sequence number once complete,
+    # fresh is 1 when spectrum and acf come from a new analysis rather than repeating the last one
+    return np.dtype([
+        ('seq', '<i8'),
+        ('time', '<f8'),
+        ('spl', '<f8'),
+        ('fresh', 'u1'),
+        ('spectrum', value_type, (spectrum_len,)),
+        ('acf', value_type, (acf_len,)),
+    ], align=True)
+
+def ring_views(buf, value_type='<f4'):
+    # header and slot array laid over a buffer whose header is already filled in
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf)
+    dtype = slot_dtype(int(header['spectrum_len']), int(header['acf_len']), value_type)
+    ring = np.ndarray((int(header['slots']),), dtype=dtype, buffer=buf, offset=HEADER_DTYPE.itemsize)
+    return header, ring
+
+class FramePublisher:
+    '''
+    Writes each frame's SPL, spectrum and autocorrelation into a ring of
+    slots in a named shared memory block. The publisher never waits for
+    readers: it overwrites the oldest slot and readers detect from the
+    sequence numbers whether a frame was overwritten under them.
+    '''
+    def __init__(self, name, spectrum_len, acf_len, slots=64):
+        dtype = slot_dtype(spectrum_len, acf_len)
+        size = HEADER_DTYPE.itemsize + slots * dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        header['write_seq'] = -1
+        header['slots'] = slots
+        header['spectrum_len'] = spectrum_len
+        header['acf_len'] = acf_len
+        del header
+        self.header, self.ring = ring_views(self.shm.buf)
+        self.ring['seq'] = -1
+        self.seq = -1
+        self.header['magic'] = MAGIC # written last so readers never see a half built ring
+
+    def publish(self, spl, spectrum, acf, fresh=True, timestamp=None):
+        '''
+        Publish one frame. fresh=False says spectrum and acf repeat the last
+        analysis; the frame still carries a new SPL value.
+        '''
+        self.seq += 1
+        slot = self.ring[self.seq % len(self.ring)]
+        slot['seq'] = -1 # mark busy before touching the payload
+        slot['time'] = time.time() if timestamp is None else timestamp
+        slot['spl'] = spl
+        slot['fresh'] = fresh
+        slot['spectrum'] = spectrum
+        slot['acf'] = acf
+        slot['seq'] = self.seq
+        self.header['write_seq'] = self.seq
+        return self.seq
+
+    def close(self):
+        del self.header, self.ring
+        self.shm.close()
+        self.shm.unlink()
+
+class FrameReader:
+    '''
+    Maps a FramePublisher's ring read-only. read() returns numpy views into
+    shared memory, not copies: use the data, then call valid() with the same
+    sequence number to confirm the publisher did not overwrite it meanwhile.
+    '''
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before python 3.13 attaching registers the block with the resource
+            # tracker, which would unlink the publisher's block when we exit
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        self.header, self.ring = ring_views(self.shm.buf)
+        if bytes(self.header['magic']) != MAGIC:
+            raise ValueError(f'{name} is not an rta frame export')
+
+    def latest_seq(self):
+        return int(self.header['write_seq'])
+
+    def read(self, seq):
+        '''
+        Return the slot for frame seq as a structured view with fields seq,
+        time, spl, fresh, spectrum and acf, or None if that frame is not
+        available. Spectrum and acf only hold a new analysis when fresh is set.
+        '''
+        slot = self.ring[seq % len(self.ring)]
+        if slot['seq'] != seq:
+            return None
+        return slot
+
+    def valid(self, seq):
+        return self.ring['seq'][seq % len(self.ring)] == seq
+
+    def follow(self, poll=0.005):
+        '''
+        Yield (seq, slot) for every frame from now on. Frames that were
+        overwritten before they could be read are skipped.
+        '''
+        next_seq = self.latest_seq() + 1
+        while True:
+            latest = self.latest_seq()
+            if latest < next_seq:
+                time.sleep(poll)
+                continue
+            # jump ahead if we fell more than a ring behind
+            next_seq = max(next_seq, latest - len(self.ring) + 1)
+            slot = self.read(next_seq)
+            if slot is not None:
+                yield next_seq, slot
+            next_seq += 1
+
+    def close(self):
+        del self.header, self.ring
+        self.shm.close()
+
+def _slow_reader(name, delay, ready, stop, paced_from, results):
+    reader = FrameReader(name)
+    # [frames read, frames overwritten while reading] before and during the paced phase
+    counts = {False: [0, 0], True: [0, 0]}
+    ready.wait()
+    for seq, slot in reader.follow():
+        if stop.is_set():
+            break
+        spl = float(slot['spl'])
+        time.sleep(delay)
+        tally = counts[seq >= paced_from.value]
+        tally[0] += 1
+        if not reader.valid(seq):
+            tally[1] += 1
+    reader.close()
+    results.put((counts[False], counts[True], spl))
+
+def test_throughput():
+    import multiprocessing
+    name = f'rta_test_{os.getpid()}'
+    duration = 1.0
+    spectrum = np.random.rand(1024).astype(np.float32)
+    acf = np.random.rand(1024).astype(np.float32)
+
+    def publish_rate(publisher):
+        frames = 0
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < duration:
+            publisher.publish(-20.0, spectrum, acf)
+            frames += 1
+        return frames / (time.perf_counter() - t0)
+
+    publisher = FramePublisher(name, len(spectrum), len(acf), slots=16)
+    try:
+        alone = publish_rate(publisher)
+
+        # readers that take 10ms per frame are far slower than the publisher;
+        # spawn them so they are independent processes like real consumers.
+        # They keep reading until stop is set, so they are busy for the whole
+        # measurement.
+        ctx = multiprocessing.get_context('spawn')
+        n_readers = 4
+        delay = 0.01
+        ready = ctx.Barrier(n_readers + 1)
+        stop = ctx.Event()
+        paced_from = ctx.Value('q', 2**62)
+        results = ctx.Queue()
+        readers = [ctx.Process(target=_slow_reader, args=(name, delay, ready, stop, paced_from, results)) for _ in range(n_readers)]
+        for r in readers:
+            r.start()
+        ready.wait()
+        with_readers = publish_rate(publisher)
+
+        # then publish slower than the readers read: every frame should arrive intact
+        paced = 50
+        paced_from.value = publisher.seq + 1
+        for _ in range(paced):
+            publisher.publish(-20.0, spectrum, acf)
+            time.sleep(2 * delay)
+        stop.set()
+
+        # keep frames coming until every reader has noticed the stop
+        reader_results = []
+        while len(reader_results) < len(readers):
+            publisher.publish(-20.0, spectrum, acf)
+            while not results.empty():
+                reader_results.append(results.get())
+            time.sleep(0.001)
+        for r in readers:
+            r.join()
+    finally:
+        publisher.close()
+
+    print(f'publisher alone: {alone:.0f} frames/s, with {len(readers)} slow readers: {with_readers:.0f} frames/s')
+    print(f'readers (flat out [read, overwritten], paced [read, overwritten], last spl): {reader_results}')
+    # a publisher paced by its readers would manage at most 1/delay frames/s
+    assert with_readers > 50 / delay, 'publisher was held back by slow readers'
+    for flat_out, paced_counts, spl in reader_results:
+        assert flat_out[0] > 0.5 * duration / delay, f'reader idle while the publisher ran flat out: {flat_out}'
+        read, overwritten = paced_counts
+        assert read - overwritten >= paced // 2, f'paced reader got too few intact frames: {paced_counts}'
+        assert spl == -20.0
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        test_throughput()
+    elif len(sys.argv) > 1:
+        # minimal reader client: print the SPL of every frame
+        reader = FrameReader(sys.argv[1])
+        try:
+            for seq, slot in reader.follow():
+                line = f'{seq} {slot["time"]:.3f} {slot["spl"]:+.1f} dB'
+                if slot['fresh']:
+                    line += f' peak bin {int(np.argmax(slot["spectrum"]))}'
+                print(line)
+        except KeyboardInterrupt:
+            pass
+        reader.close()
+    else:
+        print(f'usage: {sys.argv[0]} <export name> | test')
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# streaming spectral peak and pitch tracker
+import numpy as np
+
+def parabolic_offset(left, centre, right):
+    '''
+    Offset in bins (-0.5..0.5) of the vertex of the parabola through three
+    neighbouring samples. Works elementwise on arrays.
+    '''
+    denom = left - 2 * centre + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(denom != 0, 0.5 * (left - right) / denom, 0.0)
+    return np.clip(offset, -0.5, 0.5)
+
+def peak_buffers(n):
+    # scratch space for top_peaks on data of length n, reusable across calls
+    return np.zeros(n - 2), np.zeros(n - 2, dtype=bool), np.zeros(n - 2, dtype=bool)
+
+def top_peaks(data, k, height=-np.inf, buffers=None):
+    '''
+    Indices of the k largest local maxima in data above height, largest
+    first. Uses argpartition so only the k winners are ever sorted.
+    buffers from peak_buffers(len(data)) avoid reallocating scratch space
+    when called every frame.
+    '''
+    if buffers is None:
+        buffers = peak_buffers(len(data))
+    candidates, is_peak, scratch = buffers
+
+    # local maxima, everything else pushed to -inf so argpartition ignores it
+    inner = data[1:-1]
+    np.greater(inner, data[:-2], out=is_peak)
+    np.greater_equal(inner, data[2:], out=scratch)
+    is_peak &= scratch
+    np.greater(inner, height, out=scratch)
+    is_peak &= scratch
+    candidates.fill(-np.inf)
+    np.copyto(candidates, inner, where=is_peak)
+
+    k = min(k, len(candidates))
+    if k == 0:
+        return np.zeros(0, dtype=int)
+    top = np.argpartition(candidates, -k)[-k:]
+    top = top[np.isfinite(candidates[top])]
+    return top[np.argsort(candidates[top])[::-1]] + 1
+
+class PeakTracker:
+    '''
+    Picks the k strongest spectral peaks each frame, refines them with
+    parabolic interpolation and links them across frames into partial
+    tracks. A fundamental is estimated from the time domain autocorrelation.
+    Buffers the size of the spectrum or of the pitch search range are
+    allocated once per size and written with out=, as are the peak and track
+    state arrays. What still allocates each frame: argpartition's index
+    array (numpy offers no out= for it) and small temporaries of k or
+    max_tracks elements. The spectrum and autocorrelation are the caller's;
+    ACFMode takes the autocorrelation from FFTWPlan.autocorrelation, which
+    writes into the plan's own buffer, so feeding the tracker costs one
+    inverse FFT and no window sized allocations.
+
+    Results after update():
+    - peak_freq, peak_db, n_peaks: this frame's peaks, strongest first
+    - track_freq, track_db, track_age, track_id: tracks, age 0 marks a free slot
+    - f0, f0_confidence: fundamental in Hz (0 when unvoiced) and its ACF height
+    '''
+    def __init__(self, k=8, max_tracks=16, tolerance=2**(1/24), max_missing=5, f_min=40, f_max=2000, voicing=0.3):
+        self.k = k
+        self.max_tracks = max_tracks
+        self.log_tolerance = np.log2(tolerance)
+        self.max_missing = max_missing
+        self.f_min = f_min
+        self.f_max = f_max
+        self.voicing = voicing
+
+        self.peak_freq = np.zeros(k)
+        self.peak_db = np.zeros(k)
+        self.n_peaks = 0
+
+        self.track_freq = np.ones(max_tracks)
+        self.track_db = np.zeros(max_tracks)
+        self.track_age = np.zeros(max_tracks, dtype=int)
+        self.track_missing = np.zeros(max_tracks, dtype=int)
+        self.track_id = np.zeros(max_tracks, dtype=int)
+        self.next_id = 1
+
+        self.distance = np.zeros((k, max_tracks))
+        self.peak_index = np.arange(k)
+        self.log_peak = np.zeros(k)
+        self.log_track = np.zeros(max_tracks)
+        self.matched_peaks = np.zeros(k, dtype=bool)
+        self.matched_tracks = np.zeros(max_tracks, dtype=bool)
+        self.active = np.zeros(max_tracks, dtype=bool)
+        self.lost = np.zeros(max_tracks, dtype=bool)
+        self.lobe_end = np.zeros(0, dtype=bool)
+        self.lobe_scratch = np.zeros(0, dtype=bool)
+        self.size = 0
+
+        self.f0 = 0.0
+        self.f0_confidence = 0.0
+
+    def _allocate(self, n):
+        # only happens when the spectrum size changes, e.g. on a quality change
+        self.size = n
+        self.db = np.zeros(n)
+        self.peak_buffers = peak_buffers(n)
+
+    def update(self, magnitude, bin_hz, autocorr=None, samplerate=None):
+        '''
+        magnitude - linear frequency magnitude spectrum
+        bin_hz - width of one spectrum bin in Hz
+        autocorr - optional time domain autocorrelation, lag 0 first
+        '''
+        if len(magnitude) != self.size:
+            self._allocate(len(magnitude))
+        self.find_peaks(magnitude, bin_hz)
+        self.link()
+        if autocorr is not None and samplerate:
+            self.fundamental(autocorr, samplerate)
+
+    def find_peaks(self, magnitude, bin_hz):
+        db = self.db
+        np.maximum(magnitude, 1e-12, out=db)
+        np.log10(db, out=db)
+        db *= 20
+
+        top = top_peaks(db, self.k, buffers=self.peak_buffers)
+        n = len(top)
+
+        offset = parabolic_offset(db[top - 1], db[top], db[top + 1])
+        self.peak_freq[:n] = (top + offset) * bin_hz
+        self.peak_db[:n] = db[top] - 0.25 * (db[top - 1] - db[top + 1]) * offset
+        self.n_peaks = n
+
+    def link(self):
+        n = self.n_peaks
+        active = self.active
+        np.greater(self.track_age, 0, out=active)
+
+        # log frequency distance of every peak to every active track
+        log_peak = self.log_peak[:n]
+        np.log2(self.peak_freq[:n], out=log_peak)
+        np.log2(self.track_freq, out=self.log_track)
+        distance = self.distance[:n]
+        np.subtract(log_peak[:, None], self.log_track[None, :], out=distance)
+        np.abs(distance, out=distance)
+        np.copyto(distance, np.inf, where=~active)
+
+        matched_peaks = self.matched_peaks[:n]
+        matched_peaks.fill(False)
+        matched_tracks = self.matched_tracks
+        matched_tracks.fill(False)
+        if n and active.any():
+            # keep only pairs which are each other's nearest neighbour
+            best_track = np.argmin(distance, axis=1)
+            best_peak = np.argmin(distance, axis=0)
+            peaks = self.peak_index[:n]
+            mutual = (best_peak[best_track] == peaks) & (distance[peaks, best_track] < self.log_tolerance)
+            tracks = best_track[mutual]
+            self.track_freq[tracks] = self.peak_freq[:n][mutual]
+            self.track_db[tracks] = self.peak_db[:n][mutual]
+            self.track_age[tracks] += 1
+            self.track_missing[tracks] = 0
+            matched_peaks[mutual] = True
+            matched_tracks[tracks] = True
+
+        # age out tracks which found no peak
+        lost = self.lost
+        np.greater(active, matched_tracks, out=lost) # active and not matched
+        self.track_missing += lost
+        np.greater(self.track_missing, self.max_missing, out=matched_tracks) # reused as scratch
+        lost &= matched_tracks
+        self.track_age[lost] = 0
+
+        # start new tracks for unmatched peaks, strongest first, in free slots
+        new_peaks = np.flatnonzero(~matched_peaks)
+        free = np.flatnonzero(self.track_age == 0)[:len(new_peaks)]
+        new_peaks = new_peaks[:len(free)]
+        self.track_freq[free] = self.peak_freq[new_peaks]
+        self.track_db[free] = self.peak_db[new_peaks]
+        self.track_age[free] = 1
+        self.track_missing[free] = 0
+        self.track_id[free] = np.arange(self.next_id, self.next_id + len(free))
+        self.next_id += len(free)
+
+    def fundamental(self, autocorr, samplerate):
+        lo = max(1, int(samplerate / self.f_max))
+        hi = min(len(autocorr) - 2, int(samplerate / self.f_min))
+        if hi <= lo or autocorr[0] <= 0:
+            self.f0 = 0.0
+            self.f0_confidence = 0.0
+            return
+
+        # step over the lag 0 lobe first, its falling slope would otherwise
+        # win the argmax for any low frequency content. The lobe ends where
+        # the autocorrelation crosses zero or starts rising again.
+        if len(self.lobe_end) < hi:
+            self.lobe_end = np.zeros(hi, dtype=bool)
+            self.lobe_scratch = np.zeros(hi, dtype=bool)
+        lobe_end = self.lobe_end[:hi]
+        np.greater(autocorr[1:hi + 1], autocorr[:hi], out=lobe_end)
+        np.less_equal(autocorr[1:hi + 1], 0, out=self.lobe_scratch[:hi])
+        lobe_end |= self.lobe_scratch[:hi]
+        start = max(lo, int(np.argmax(lobe_end)) + 1)
+        if not lobe_end.any() or start >= hi:
+            self.f0 = 0.0
+            self.f0_confidence = 0.0
+            return
+
+        lag = start + int(np.argmax(autocorr[start:hi]))
+        self.f0_confidence = float(autocorr[lag] / autocorr[0])
+        # only a real local maximum is a period, not the edge of the search range
+        peak = lag > start and autocorr[lag - 1] <= autocorr[lag] >= autocorr[lag + 1]
+        if not peak or self.f0_confidence < self.voicing:
+            self.f0 = 0.0
+            return
+        offset = parabolic_offset(autocorr[lag - 1], autocorr[lag], autocorr[lag + 1])
+        self.f0 = float(samplerate / (lag + offset))
+
+    def active_tracks(self, min_age=1):
+        # (id, freq, db) of tracks alive for at least min_age frames
+        alive = self.track_age >= min_age
+        return self.track_id[alive], self.track_freq[alive], self.track_db[alive]
+
+def test_tracker():
+    samplerate = 48000
+    n = 8192
+    t = np.arange(n) / samplerate
+    window = np.hanning(n)
+    tracker = PeakTracker(k=6)
+    for frame in range(10):
+        # 220 Hz with harmonics, drifting up by 1 Hz per frame
+        f = 220 + frame
+        x = sum(np.sin(2 * np.pi * h * f * t) / h for h in range(1, 5)) * window
+        spectrum = np.fft.rfft(x)
+        tracker.update(np.abs(spectrum), samplerate / n, np.fft.irfft(np.abs(spectrum) ** 2), samplerate)
+
+    assert abs(tracker.peak_freq[0] - f) < 1.0, tracker.peak_freq
+    assert abs(tracker.f0 - f) < 2.0, tracker.f0
+    ids, freqs, _ = tracker.active_tracks(min_age=10)
+    for h in range(1, 5):
+        assert np.min(np.abs(freqs - h * f)) < 2.0, (h, freqs)
+    print(f'f0 {tracker.f0:.1f} Hz ({tracker.f0_confidence:.2f}), tracks {sorted(np.round(freqs, 1))}')
+
+    def acf(x):
+        spectrum = np.abs(np.fft.rfft(x * np.hanning(len(x))))
+        return spectrum, np.fft.irfft(spectrum ** 2)
+
+    # a low tone at the window sizes the cheaper quality levels use
+    for n in (8192, 16384, 65536):
+        spectrum, autocorr = acf(np.sin(2 * np.pi * 50 * np.arange(n) / samplerate))
+        tracker.update(spectrum, samplerate / n, autocorr, samplerate)
+        assert abs(tracker.f0 - 50) < 1.0, (n, tracker.f0)
+
+    # low passed noise has no period and must not be reported as voiced
+    n = 65536
+    noise = np.fft.rfft(np.random.default_rng(0).standard_normal(n))
+    noise[np.fft.rfftfreq(n, 1 / samplerate) > 200] = 0
+    spectrum, autocorr = acf(np.fft.irfft(noise))
+    tracker.update(spectrum, samplerate / n, autocorr, samplerate)
+    assert tracker.f0 == 0, (tracker.f0, tracker.f0_confidence)
+    print('50 Hz tone and 200 Hz rumble ok')
+
+if __name__ == "__main__":
+    test_tracker()
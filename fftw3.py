@@ -1,28 +1,138 @@
 import numpy as np
 import ctypes
-from ctypes import POINTER, c_double, c_uint, c_void_p
+from ctypes import POINTER, c_double, c_int, c_uint, c_size_t, c_void_p
 
-# Load the FFTW3 library
-fftw3 = ctypes.CDLL('libfftw3.so')
+FFTW_MEASURE = 0
 
-# Define the FFTW3 functions
-fftw_plan_dft_r2c_1d = fftw3.fftw_plan_dft_r2c_1d
-fftw_plan_dft_r2c_1d.restype = c_void_p
-fftw_plan_dft_r2c_1d.argtypes = [c_uint, POINTER(c_double), POINTER(c_void_p), c_uint]
+# The FFTW3 library is loaded on first use by load_fftw() rather than at import
+fftw3 = None
+fftw_plan_dft_r2c_1d = None
+fftw_plan_dft_c2r_1d = None
+fftw_execute = None
+fftw_destroy_plan = None
+fftw_alloc_real = None
+fftw_alloc_complex = None
+fftw_free = None
 
-fftw_execute = fftw3.fftw_execute
-fftw_execute.restype = None
-fftw_execute.argtypes = [c_void_p]
+def load_fftw():
+    global fftw3, fftw_plan_dft_r2c_1d, fftw_plan_dft_c2r_1d, fftw_execute, fftw_destroy_plan
+    global fftw_alloc_real, fftw_alloc_complex, fftw_free
+    if fftw3 is not None:
+        return fftw3
 
-fftw_destroy_plan = fftw3.fftw_destroy_plan
-fftw_destroy_plan.restype = None
-fftw_destroy_plan.argtypes = [c_void_p]
+    # Load the FFTW3 library
+    lib = ctypes.CDLL('libfftw3.so')
+
+    # Define the FFTW3 functions
+    fftw_plan_dft_r2c_1d = lib.fftw_plan_dft_r2c_1d
+    fftw_plan_dft_r2c_1d.restype = c_void_p
+    fftw_plan_dft_r2c_1d.argtypes = [c_int, c_void_p, c_void_p, c_uint]
+
+    fftw_plan_dft_c2r_1d = lib.fftw_plan_dft_c2r_1d
+    fftw_plan_dft_c2r_1d.restype = c_void_p
+    fftw_plan_dft_c2r_1d.argtypes = [c_int, c_void_p, c_void_p, c_uint]
+
+    fftw_execute = lib.fftw_execute
+    fftw_execute.restype = None
+    fftw_execute.argtypes = [c_void_p]
+
+    fftw_destroy_plan = lib.fftw_destroy_plan
+    fftw_destroy_plan.restype = None
+    fftw_destroy_plan.argtypes = [c_void_p]
+
+    # FFTW's own allocators give the SIMD alignment the plans assume
+    fftw_alloc_real = lib.fftw_alloc_real
+    fftw_alloc_real.restype = c_void_p
+    fftw_alloc_real.argtypes = [c_size_t]
+
+    fftw_alloc_complex = lib.fftw_alloc_complex
+    fftw_alloc_complex.restype = c_void_p
+    fftw_alloc_complex.argtypes = [c_size_t]
+
+    fftw_free = lib.fftw_free
+    fftw_free.restype = None
+    fftw_free.argtypes = [c_void_p]
+
+    fftw3 = lib
+    return fftw3
+
+def real_array(ptr, n):
+    # numpy view of an FFTW allocated buffer of n doubles
+    return np.ctypeslib.as_array(ctypes.cast(ptr, POINTER(c_double)), shape=(n,))
+
+class FFTWPlan:
+    '''
+    A real to complex FFT of one size, planned once with FFTW_MEASURE on its
+    own aligned buffers. Planning scribbles over the input buffer, which is
+    why it happens here before any data is copied in. With inverse, a
+    complex to real plan is also made for autocorrelation().
+    '''
+    def __init__(self, n, inverse=False):
+        load_fftw()
+        self.n = n
+        self.in_ptr = fftw_alloc_real(n)
+        self.out_ptr = fftw_alloc_complex(n // 2 + 1)
+        self.input = real_array(self.in_ptr, n)
+        self.output = real_array(self.out_ptr, 2 * (n // 2 + 1)).view(np.complex128)
+        self.plan = fftw_plan_dft_r2c_1d(n, self.in_ptr, self.out_ptr, FFTW_MEASURE)
+        self.inverse = None
+        if inverse:
+            self.plan_inverse()
+
+    def plan_inverse(self):
+        # power spectrum in, autocorrelation out
+        n = self.n
+        self.power_ptr = fftw_alloc_complex(n // 2 + 1)
+        self.acf_ptr = fftw_alloc_real(n)
+        self.power = real_array(self.power_ptr, 2 * (n // 2 + 1)).view(np.complex128)
+        self.acf = real_array(self.acf_ptr, n)
+        self.inverse = fftw_plan_dft_c2r_1d(n, self.power_ptr, self.acf_ptr, FFTW_MEASURE)
+
+    def execute(self, data):
+        '''
+        Transform data (length n). The result is the plan's output buffer,
+        overwritten by the next call - copy it if it must be kept.
+        '''
+        self.input[:] = data
+        fftw_execute(self.plan)
+        return self.output
+
+    def autocorrelation(self, magnitude):
+        '''
+        Circular autocorrelation of a signal from its magnitude spectrum, the
+        same as np.fft.irfft(magnitude**2) but computed in the plan's own
+        buffers. The result is overwritten by the next call.
+        '''
+        if self.inverse is None:
+            self.plan_inverse()
+        np.square(magnitude, out=self.power.real)
+        self.power.imag.fill(0) # complex to real transforms destroy their input
+        fftw_execute(self.inverse)
+        self.acf *= 1 / self.n
+        return self.acf
+
+    def __del__(self):
+        if getattr(self, 'plan', None):
+            fftw_destroy_plan(self.plan)
+            fftw_free(self.in_ptr)
+            fftw_free(self.out_ptr)
+            self.plan = None
+        if getattr(self, 'inverse', None):
+            fftw_destroy_plan(self.inverse)
+            fftw_free(self.power_ptr)
+            fftw_free(self.acf_ptr)
+            self.inverse = None
+
+plans = {}
+
+def fftw_plan(n, inverse=False):
+    # plans are cached per size, so each size is only measured once
+    if n not in plans:
+        plans[n] = FFTWPlan(n, inverse)
+    elif inverse and plans[n].inverse is None:
+        plans[n].plan_inverse()
+    return plans[n]
 
 # Define a function to perform FFT using FFTW3
 def fftw_rfft(data):
-    n = len(data)
-    output = np.empty(n//2 + 1, dtype=np.complex128)
-    plan = fftw_plan_dft_r2c_1d(n, data.ctypes.data_as(POINTER(c_double)), output.ctypes.data_as(POINTER(c_void_p)), 0)
-    fftw_execute(plan)
-    fftw_destroy_plan(plan)
-    return output
\ No newline at end of file
+    return fftw_plan(len(data)).execute(data).copy()
@@ -1,12 +1,10 @@
 #!/usr/bin/env python3
 # utility functions for the project
-from scipy.signal import find_peaks, freqz
+# scipy and pygame are imported where they are used so that importing util stays cheap
 import numpy as np
 import time
 import colorsys
 import os
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
-import pygame
 
 def sine_generator(frequency):
     '''
@@ -88,6 +86,8 @@ def resolution_generator():
         yield buffer
 
 def wait_for_keypress():
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    import pygame
     keypress = None
     while True:
         for event in pygame.event.get():
@@ -121,6 +121,8 @@ def print_fft_summary(label, fft_data, freq_bins):
     - num_peaks: The number of top peaks to display.
     """
     global last_print
+    from scipy.signal import peak_prominences
+    from Tracker import top_peaks
     height_threshold = 0
     prominence = 1
 
@@ -128,19 +130,15 @@ def print_fft_summary(label, fft_data, freq_bins):
     bold = "\033[1m"
     reset = "\033[0m"
 
-    # Find peaks in the FFT data
-    peaks, _ = find_peaks(fft_data, height=height_threshold, prominence=prominence)
-
-    # Sort peaks by magnitude
-    sorted_peaks = sorted(peaks, key=lambda x: fft_data[x], reverse=True)
-
-    # Select the top N peaks
-    num_peaks = min(2,len(sorted_peaks))
-    top_peaks = sorted_peaks[:num_peaks]
+    # Find every peak above the threshold, largest first, and keep the top N
+    # which stand out from their surroundings by at least prominence
+    top = top_peaks(fft_data, len(fft_data), height=height_threshold)
+    top = top[peak_prominences(fft_data, top)[0] >= prominence][:2]
+    num_peaks = len(top)
 
     # Print the peaks
     if num_peaks > 0:
-        peak_string = 'Peaks: ' + ', '.join([f'{fft_data[f]:+.2f} db @ {freq_bins[f]:.1f} Hz' for f in top_peaks])
+        peak_string = 'Peaks: ' + ', '.join([f'{fft_data[f]:+.2f} db @ {freq_bins[f]:.1f} Hz' for f in top])
         this_print = f'{label} - Mean: {np.mean(fft_data):.1f} db, Min: {np.min(fft_data):.1f} db, Max: {np.max(fft_data):.1f} db' + peak_string
     else:
         this_print = f"{label} - Mean: {np.mean(fft_data):.1f} db, Min: {np.min(fft_data):.1f} db, Max: {np.max(fft_data):.1f} db"
@@ -165,6 +163,7 @@ def format_hz(hz):
 
 
 def get_filter_freq(filter, samplerate):
+    from scipy.signal import freqz
     w,h = freqz(filter)
     epsilon = 1e-10
     gain_db = 20 * np.log10(np.abs(h) + epsilon)